@@ -1,10 +1,19 @@
 import click
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import time
 from pathlib import Path
 
-import tomlkit
-from importlib import metadata
-from packaging.version import parse as parse_version
-from env_snapshot.core import create_snapshot
+# Heavier imports (env_snapshot.core, packaging, tomli_w) are deferred into the
+# functions that need them so `--help` and shell completion only pay for click.
+
+# Most recently used snapshots kept in the cache; older ones are evicted
+CACHE_MAX_ENTRIES = 32
+# Temp files older than this are leftovers of killed runs, not writes in progress
+CACHE_TMP_MAX_AGE = 3600
 
 @click.command()
 @click.option(
@@ -28,44 +37,85 @@ from env_snapshot.core import create_snapshot
     help="Output file path.",
     show_default=True,
 )
-def main(base_toml: Path, requirements: Path, output: str) -> None:
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Rebuild the snapshot even if an identical one is cached.",
+)
+def main(base_toml: Path, requirements: Path, output: str, no_cache: bool) -> None:
     """
     Generates a locked pyproject.toml snapshot from the current environment.
 
     BASE_TOML: Path to the base pyproject.toml file.
     REQUIREMENTS: Path to the requirements.txt file.
     """  
+    from env_snapshot.core import collect_installed_raw, create_snapshot, start_uv_pip_tree
+
     try:
-        snapshot_doc = create_snapshot(
-            base_toml_path=str(base_toml),
-            requirements_path=str(requirements),
-        )
-        
-        # Apply specific patches (Business Rules)
-        update_torch_index_url(snapshot_doc)
-        
-        # Handle I/O (Interface Adapter)
-        save_snapshot_to_file(snapshot_doc, output)
+        # Start `uv pip tree` first so its cold start overlaps the distribution walk.
+        # uv is only needed to build a new snapshot, so a cache hit can do without it.
+        tree_proc, tree_error = None, None
+        try:
+            tree_proc = start_uv_pip_tree()
+        except OSError as e:
+            tree_error = e
+
+        with tree_proc or contextlib.nullcontext():
+            installed_raw = collect_installed_raw()
+            cache_path = snapshot_cache_path(base_toml, requirements, installed_raw)
+
+            if not no_cache and cache_path.is_file():
+                if tree_proc is not None:
+                    tree_proc.kill()
+                shutil.copyfile(cache_path, output)
+                # Mark the entry as recently used for eviction (best effort)
+                with contextlib.suppress(OSError):
+                    os.utime(cache_path)
+            else:
+                if tree_error is not None:
+                    raise tree_error
+
+                snapshot_doc = create_snapshot(
+                    base_toml_path=str(base_toml),
+                    requirements_path=str(requirements),
+                    installed_raw=installed_raw,
+                    tree_proc=tree_proc,
+                )
+
+                # Apply specific patches (Business Rules)
+                update_torch_index_url(snapshot_doc)
+
+                # Handle I/O (Interface Adapter)
+                save_snapshot_to_file(snapshot_doc, output)
+                if not no_cache:
+                    store_snapshot_in_cache(output, cache_path)
 
         click.echo(f"Snapshot successfully created: {Path(output).resolve()}")
     except Exception as e:
         raise click.ClickException(f"Error during snapshot creation: {e}")
 
 
-def update_torch_index_url(base_doc: tomlkit.TOMLDocument) -> None:
+def update_torch_index_url(base_doc: dict) -> None:
     """
     Update the PyTorch index URL in the snapshot if a placeholder is present.
-    Uses the robust collect_installed_packages to get the version from the target environment.
+    Looks up only the torch distribution of the target environment to get its version.
     """
     try:
-        from env_snapshot.core import collect_installed_packages, pkg_key
-        installed = collect_installed_packages()
-        torch_pkg = installed.get(pkg_key("torch"))
+        # Cheap probe first: most base templates carry no placeholder at all
+        indices = base_doc.get("tool", {}).get("uv", {}).get("index", [])
+        placeholders = [index for index in indices if "XXX" in index.get("url", "")]
+        if not placeholders:
+            return
+
+        from packaging.version import parse as parse_version
+        from env_snapshot.core import installed_version
+        torch_version = installed_version("torch")
         
-        if not torch_pkg:
+        if not torch_version:
             return
 
-        version = parse_version(torch_pkg.version)
+        version = parse_version(torch_version)
         
         if not version.local:
             return
@@ -73,11 +123,8 @@ def update_torch_index_url(base_doc: tomlkit.TOMLDocument) -> None:
         new_url = f"https://download.pytorch.org/whl/{version.local}"
         
         # Replace XXX in index URLs
-        if "tool" in base_doc and "uv" in base_doc["tool"]:
-            base_doc["tool"]["uv"]["index"] = [
-                {**index, "url": new_url} if "XXX" in index.get("url", "") else index
-                for index in base_doc["tool"]["uv"].get("index", [])
-            ]
+        for index in placeholders:
+            index["url"] = new_url
     except Exception as e:
         # Avoid crashing if optional patching fails
         import logging
@@ -85,11 +132,86 @@ def update_torch_index_url(base_doc: tomlkit.TOMLDocument) -> None:
 
 
 def save_snapshot_to_file(
-    base_doc: tomlkit.TOMLDocument,
+    base_doc: dict,
     save_name: str,
 ) -> None:
+    import tomli_w
+
     path = Path(save_name)
-    path.write_text(tomlkit.dumps(base_doc), encoding="utf-8")
+    path.write_bytes(tomli_w.dumps(base_doc).encode("utf-8"))
+
+
+def cache_dir() -> Path:
+    """Per-user cache directory: %LOCALAPPDATA% on Windows, $XDG_CACHE_HOME (or ~/.cache) elsewhere."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "env_snapshot"
+
+
+def tool_version() -> str:
+    from importlib import metadata
+
+    try:
+        return metadata.version("env-snapshot")
+    except metadata.PackageNotFoundError:
+        # Running from a source tree that was never installed
+        return "0+unknown"
+
+
+def snapshot_cache_path(base_toml: Path, requirements: Path, installed_raw: dict) -> Path:
+    """
+    Cache location for a snapshot, keyed by the env-snapshot version, the base template,
+    the requirements file and a fingerprint of the installed packages (name, version and
+    install source).
+    """
+    # The tool version invalidates every entry on upgrade, as the output format may change
+    digest = hashlib.sha256(tool_version().encode("utf-8"))
+    for path in (base_toml, requirements):
+        digest.update(hashlib.sha256(path.read_bytes() if path.exists() else b"").digest())
+
+    env_lines = sorted(
+        f"{key}=={raw.version} {raw.url or ''} {int(raw.editable)}"
+        for key, raw in installed_raw.items()
+    )
+    digest.update("\n".join(env_lines).encode("utf-8"))
+    return cache_dir() / f"{digest.hexdigest()}.toml"
+
+
+def store_snapshot_in_cache(output: str, cache_path: Path) -> None:
+    tmp_name = None
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file in the same directory, then rename atomically
+        fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(output, tmp_name)
+        os.replace(tmp_name, cache_path)
+        tmp_name = None
+        prune_cache(cache_path.parent)
+    except OSError as e:
+        # The cache is an optimisation only; never fail the snapshot because of it
+        import logging
+        logging.warning(f"Failed to cache snapshot: {e}")
+    finally:
+        # Set only if the rename did not happen (error or interrupt)
+        if tmp_name is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_name)
+
+
+def prune_cache(directory: Path, keep: int = CACHE_MAX_ENTRIES) -> None:
+    # Least recently written or hit entries go first
+    entries = sorted(directory.glob("*.toml"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale in entries[keep:]:
+        stale.unlink(missing_ok=True)
+
+    # Temp files left behind by runs that were killed before they could clean up
+    cutoff = time.time() - CACHE_TMP_MAX_AGE
+    for leftover in directory.glob("*.tmp"):
+        if leftover.stat().st_mtime < cutoff:
+            leftover.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
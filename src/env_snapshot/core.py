@@ -12,24 +12,35 @@ Design Principles:
 3. **Immutability**: Input data is not modified.
 
 Main Functions:
-- `collect_installed_packages`: Collects installed package info from the TARGET environment using `uv pip list`.
+- `collect_installed_raw`: Collects installed package info from the TARGET environment via `importlib.metadata`.
 - `assign_package_groups`: Assigns packages to optional-dependencies based on rules.
+- `materialize_packages`: Builds `Package` objects for the packages that end up in the snapshot.
 - `build_uv_sections`: Infers source/index config.
-- `render_snapshot`: Renders to tomlkit document.
+- `render_snapshot`: Renders into the base document (a plain dict).
 - `create_snapshot`: Main orchestration.
 """
 from __future__ import annotations
 
 import json
+import os
+import re
+import shutil
 import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from importlib import metadata
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple, Any
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 from urllib.parse import urlparse
 
-import tomlkit
-from packaging.requirements import Requirement
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
 from packaging.utils import canonicalize_name
-from pydantic import BaseModel, PrivateAttr, computed_field
 
 
 # -------------------------------------------------
@@ -55,12 +66,41 @@ PRIORITY_ENV_INFERENCE = 40
 # Small helpers (library-backed)
 # -------------------------------------------------
 
+# Both are pure and called for every package / dependency line, so memoize them.
+
+@lru_cache(maxsize=None)
 def pkg_key(name: str) -> str:
     # PEP 503 canonical form (pip / uv / packaging standard)
     return canonicalize_name(name)
 
 
+# Bare `name` or `name<specifiers>` with no extras, URL or markers. Only release
+# versions (`1`, `2.9.1`) are accepted, with `.*` after `==`/`!=` and at least two
+# segments after `~=`; anything else (pre/post/local versions, `===`, malformed
+# input) goes to packaging, which parses or rejects it.
+_RELEASE = r"\d+(?:\.\d+)*"
+_SPECIFIER = (
+    rf"(?:(?:==|!=)\s*{_RELEASE}(?:\.\*)?"
+    rf"|~=\s*\d+(?:\.\d+)+"
+    rf"|(?:<=|>=|<|>)\s*{_RELEASE})"
+)
+_SIMPLE_REQ_RE = re.compile(
+    rf"\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*"
+    rf"(?:{_SPECIFIER}(?:\s*,\s*{_SPECIFIER})*)?\s*",
+    # ASCII only, like packaging: Unicode digits and spaces must not pass
+    re.ASCII,
+)
+
+
+@lru_cache(maxsize=None)
 def requirement_name(req: str) -> str:
+    # Most base dependencies are plain `pkg>=x`; only hand the rest to the PEP 508 parser
+    m = _SIMPLE_REQ_RE.fullmatch(req)
+    if m:
+        return m.group(1)
+
+    # packaging.requirements pulls in the whole PEP 508 parser; import it on first use
+    from packaging.requirements import Requirement
     return Requirement(req).name
 
 
@@ -73,149 +113,253 @@ def index_name_from_url(url: str) -> str:
 # Domain model
 # -------------------------------------------------
 
-class Package(BaseModel):
+class RawPackage(NamedTuple):
+    # What the environment says about one distribution. Every installed distribution
+    # gets one; only kept packages become `Package`.
+    pkg_name: str
+    version: str
+    url: Optional[str]
+    editable: bool
+    is_vcs: bool
+
+
+# (group, priority) decided for a package key during group assignment
+GroupDecision = Tuple[str, int]
+
+
+@dataclass(slots=True)
+class Package:
     pkg_name: str
     version: str
     url: Optional[str] = None
     editable: bool = False
+    is_vcs: bool = False
 
     group: Optional[str] = None
     tool_uv_sources_indexname: Optional[str] = None
-    _group_priority: int = PrivateAttr(default=-1)
-
-    @computed_field
-    @property
-    def install_sources(self) -> Optional[str]:
-        return self.url
-
-    def set_group(self, group: str, priority: int) -> None:
-        if priority > self._group_priority:
-            self.group = group
-            self._group_priority = priority
 
 
 # -------------------------------------------------
 # Stage 1: environment collection
 # -------------------------------------------------
 
-def collect_installed_packages() -> Dict[str, Package]:
+@lru_cache(maxsize=None)
+def target_site_paths() -> Tuple[str, ...]:
     """
-    Uses `uv pip list --format json` to get installed packages from the TARGET environment.
-    This inspects the active environment (e.g. .venv) where the user is running the command,
-    NOT the isolated tool environment.
+    Locates the import paths of the TARGET environment the same way `uv pip` does:
+    the active virtualenv, then the active conda env, then a `.venv` in the current
+    directory or any parent, then the first `python` on PATH.
+    Raises RuntimeError if none of them exists, rather than reading the tool's own env.
     """
-    # Run uv pip list to get the target environment's packages
-    # This automatically respects usage context (e.g. active .venv)
+    candidates = [os.environ.get("VIRTUAL_ENV"), os.environ.get("CONDA_PREFIX")]
+    cwd = Path.cwd()
+    candidates += [str(d / ".venv") for d in (cwd, *cwd.parents)]
+
+    for prefix in filter(None, candidates):
+        root = Path(prefix)
+        if not (root / "pyvenv.cfg").is_file() and not (root / "conda-meta").is_dir():
+            continue
+        site_dirs = [*root.glob("lib/python*/site-packages"), root / "Lib" / "site-packages"]
+        found = [str(p) for p in site_dirs if p.is_dir()]
+        if found:
+            return tuple(found)
+
+    # No environment to read directly: ask the interpreter uv would fall back to
+    python = shutil.which("python") or shutil.which("python3")
+    if python is None:
+        raise RuntimeError(
+            "No target Python environment found: no active virtualenv or conda env, "
+            "no .venv in the current directory or its parents, and no python on PATH."
+        )
     out = subprocess.run(
-        ["uv", "pip", "list", "--format", "json"],
+        [python, "-c", "import json, sys; print(json.dumps(sys.path))"],
         capture_output=True,
         text=True,
         check=True,
     ).stdout
+    return tuple(p for p in json.loads(out) if p)
 
-    data: List[Dict[str, Any]] = json.loads(out)
-    
+
+def collect_installed_raw() -> Dict[str, RawPackage]:
+    """
+    Walks the distributions of the TARGET environment in-process via `importlib.metadata`.
+    This inspects the active environment (e.g. .venv) where the user is running the command,
+    NOT the isolated tool environment.
+    """
     packages = {}
-    for item in data:
-        # item structure from uv pip list --format json: 
-        # {"name": "...", "version": "...", "url": "...", "editable": bool, ...}
-        name = item.get("name", "")
+    for dist in metadata.distributions(path=list(target_site_paths())):
+        # `dist.metadata` re-reads and re-parses METADATA on every access, so take it once
+        meta = dist.metadata
+        name = meta["Name"]
         if not name:
             continue
-            
-        packages[pkg_key(name)] = Package(
+
+        key = pkg_key(name)
+        if key in packages:
+            # Shadowed by an earlier entry on the search path
+            continue
+
+        # PEP 610 direct_url.json, present for URL / local / VCS installs
+        direct_url = json.loads(dist.read_text("direct_url.json") or "null") or {}
+        packages[key] = RawPackage(
             pkg_name=name,
-            version=item.get("version", ""),
-            url=item.get("url"), # Direct URL (e.g. from direct_url.json)
-            editable=item.get("editable", False),
+            version=meta["Version"],
+            url=direct_url.get("url"),
+            editable=direct_url.get("dir_info", {}).get("editable", False),
+            is_vcs="vcs_info" in direct_url,
         )
     return packages
 
 
-def get_uv_root_dependencies() -> List[str]:
+def installed_version(name: str) -> Optional[str]:
+    """
+    Version of a single distribution in the TARGET environment, or None if it is absent.
+    Looks the name up directly instead of walking every installed distribution.
+    """
+    dist = next(iter(metadata.distributions(name=name, path=list(target_site_paths()))), None)
+    return dist.version if dist is not None else None
+
+
+# `uv pip tree` line: optional tree guides, then "<name> v<version>"
+_ROOT_RE = re.compile(r"^[│ ]*(?:[├└]──\s*)?(\S+)\s+v\d\S*")
+
+
+def start_uv_pip_tree() -> subprocess.Popen:
+    """
+    Starts `uv pip tree --depth 0` without waiting for it, so uv's cold start can
+    overlap other work. Hand the process to `read_uv_root_dependencies`.
+    """
     # Use uv to find what user explicitly installed via `uv pip install`
-    out = subprocess.run(
+    return subprocess.Popen(
         ["uv", "pip", "tree", "--depth", "0"],
-        capture_output=True,
-        text=True,
-        check=True,
-    ).stdout
+        stdout=subprocess.PIPE,
+        # uv reports the environment it picked on stderr; keep it off the user's terminal
+        stderr=subprocess.DEVNULL,
+        encoding="utf-8",
+        bufsize=1,
+    )
 
-    roots = []
-    for line in out.splitlines():
-        clean = line.replace("├── ", "").replace("└── ", "").strip()
-        if " v" in clean:
-            roots.append(clean.split(" v")[0])
+
+def read_uv_root_dependencies(proc: subprocess.Popen) -> List[str]:
+    # Stream stdout and match line by line instead of buffering the whole tree
+    with proc:
+        roots = [m.group(1) for line in proc.stdout if (m := _ROOT_RE.match(line))]
+
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
     return roots
 
 
+def get_uv_root_dependencies() -> List[str]:
+    return read_uv_root_dependencies(start_uv_pip_tree())
+
+
+# Leading distribution name of a requirements.txt line, only when what follows it
+# cannot turn it into something else (`git+https://...`, `https://...`)
+_REQ_NAME_RE = re.compile(
+    rb"^[ \t]*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)(?=[ \t\r\[;#<>=!~]|$)"
+)
+
+
 def parse_requirements_file(path: str) -> List[str]:
+    """Canonical (PEP 503) names of the requirements listed in `path`."""
     if not Path(path).exists():
         return []
-        
-    return [
-        requirement_name(line.strip())
-        for line in Path(path).read_text(encoding="utf-8").splitlines()
-        if line.strip() and not line.startswith("#")
-    ]
+
+    names = []
+    for line in Path(path).read_bytes().split(b"\n"):
+        stripped = line.strip()
+        if not stripped or stripped.startswith(b"#"):
+            continue
+        m = _REQ_NAME_RE.match(line)
+        if m:
+            names.append(pkg_key(m.group(1).decode("ascii")))
+        else:
+            # Not a plain name (options, URLs, ...): let packaging parse or reject it
+            names.append(pkg_key(requirement_name(stripped.decode("utf-8"))))
+    return names
 
 
 # -------------------------------------------------
 # Stage 2: group assignment
 # -------------------------------------------------
 
-def infer_group_from_environment(pkg: Package) -> Optional[str]:
-    # Check editable status from JSON output
-    if pkg.editable:
+def infer_group_from_environment(raw: RawPackage) -> Optional[str]:
+    # Check editable status from direct_url.json
+    if raw.editable:
         return GROUP_USER_COMPILED
 
-    # Check source URL from JSON output
-    if not pkg.url:
+    # Check source URL from direct_url.json
+    url = raw.url
+    if not url:
         return None
 
-    url = pkg.url
+    if raw.is_vcs:
+        return "other-vcs"
+
     if url.startswith("file://"):
         return GROUP_USER_COMPILED
     
     if url.startswith(("http://", "https://")) and url.lower().endswith(".whl"):
         return GROUP_USER_DOWNLOAD
-        
-    if url.startswith("git+"):
-         return "other-vcs"
 
     return None
 
 
 def assign_package_groups(
-    installed: Dict[str, Package],
+    installed: Dict[str, RawPackage],
     base_doc,
     requirements: Iterable[str],
     root_dependencies: Iterable[str],
-) -> None:
-    def assign(name: str, group: str, priority: int) -> None:
-        key = pkg_key(name)
-        if key not in installed:
-             # Robustness check: requirement exists but package not found in target env
-             return
-        installed[key].set_group(group, priority)
+) -> Dict[str, GroupDecision]:
+    # (key, group, priority) in ascending priority; within a priority the first one wins
+    project = base_doc["project"]
+    ops: List[Tuple[str, str, int]] = [
+        (pkg_key(name), GROUP_USER_DOWNLOAD, PRIORITY_ROOT_DEPENDENCY)
+        for name in root_dependencies
+    ]
+    ops += [
+        (pkg_key(requirement_name(dep)), GROUP_PROJECT_DEPENDENCY, PRIORITY_BASE_TOML)
+        for dep in project.get("dependencies", [])
+    ]
+    ops += [
+        (pkg_key(requirement_name(dep)), group_name, PRIORITY_BASE_TOML)
+        for group_name, deps in project.get("optional-dependencies", {}).items()
+        for dep in deps
+    ]
+    ops += [
+        (pkg_key(name), GROUP_PROJECT_DEPENDENCY, PRIORITY_REQUIREMENTS)
+        for name in requirements
+    ]
 
-    for name in root_dependencies:
-        assign(name, GROUP_USER_DOWNLOAD, PRIORITY_ROOT_DEPENDENCY)
+    groups: Dict[str, GroupDecision] = {}
+    for key, group, priority in ops:
+        # Robustness check: requirement exists but package not found in target env
+        if key not in installed:
+            continue
+        # Higher priority overrides lower; an equal priority keeps the first decision
+        if key not in groups or priority > groups[key][1]:
+            groups[key] = (group, priority)
 
-    for dep in base_doc["project"].get("dependencies", []):
-        assign(requirement_name(dep), GROUP_PROJECT_DEPENDENCY, PRIORITY_BASE_TOML)
+    # Environment inference has the highest priority, so it always overrides
+    for key, raw in installed.items():
+        inferred = infer_group_from_environment(raw)
+        if inferred:
+            groups[key] = (inferred, PRIORITY_ENV_INFERENCE)
 
-    for group_name, deps in base_doc["project"].get("optional-dependencies", {}).items():
-        for dep in deps:
-            assign(requirement_name(dep), group_name, PRIORITY_BASE_TOML)
+    return groups
 
-    for name in requirements:
-        assign(name, GROUP_PROJECT_DEPENDENCY, PRIORITY_REQUIREMENTS)
 
-    for pkg in installed.values():
-        inferred = infer_group_from_environment(pkg)
-        if inferred:
-            pkg.set_group(inferred, PRIORITY_ENV_INFERENCE)
+def materialize_packages(
+    installed: Dict[str, RawPackage],
+    groups: Dict[str, GroupDecision],
+    keep_keys: Iterable[str],
+) -> Dict[str, Package]:
+    # Only the kept packages are turned into `Package` objects
+    return {
+        k: Package(**installed[k]._asdict(), group=groups[k][0] if k in groups else None)
+        for k in keep_keys
+    }
 
 
 # -------------------------------------------------
@@ -229,8 +373,8 @@ def assign_uv_index_info(installed: Dict[str, Package], base_doc) -> None:
             installed[key].tool_uv_sources_indexname = spec["index"]
 
     for pkg in installed.values():
-        if pkg.tool_uv_sources_indexname is None and pkg.install_sources:
-            pkg.tool_uv_sources_indexname = index_name_from_url(pkg.install_sources)
+        if pkg.tool_uv_sources_indexname is None and pkg.url:
+            pkg.tool_uv_sources_indexname = index_name_from_url(pkg.url)
 
 
 def build_uv_sections(
@@ -238,19 +382,19 @@ def build_uv_sections(
     base_doc,
     keep_keys: Iterable[str],
 ) -> Tuple[dict, list]:
-    inferred_sources = {
-        installed[k].pkg_name: {"index": installed[k].tool_uv_sources_indexname}
-        for k in keep_keys
-        if installed[k].tool_uv_sources_indexname
-    }
-
-    inferred_urls = {
-        installed[k].tool_uv_sources_indexname: installed[k].install_sources
-        for k in keep_keys
-        if installed[k].tool_uv_sources_indexname and installed[k].install_sources
-    }
+    inferred_sources: Dict[str, dict] = {}
+    inferred_urls: Dict[str, str] = {}
+    for k in keep_keys:
+        pkg = installed[k]
+        index_name = pkg.tool_uv_sources_indexname
+        if not index_name:
+            continue
+        inferred_sources[pkg.pkg_name] = {"index": index_name}
+        if pkg.url:
+            inferred_urls[index_name] = pkg.url
 
-    merged_indices = [dict(x) for x in base_doc["tool"]["uv"]["index"]]
+    # Extend the parsed base list in place; only missing indices are allocated
+    merged_indices = base_doc["tool"]["uv"]["index"]
     declared_names = {x["name"] for x in merged_indices if "name" in x}
 
     required_names = {v["index"] for v in inferred_sources.values()}
@@ -275,24 +419,19 @@ def render_snapshot(
     inferred_sources: dict,
     merged_indices: list,
 ) -> None:
-    base_doc["project"]["dependencies"] = []
-    base_doc["project"]["optional-dependencies"] = {}
+    dependencies: List[str] = []
+    optional: Dict[str, List[str]] = defaultdict(list)
 
+    # Walking keys in sorted order leaves every bucket (and the group order) sorted
     for key in sorted(keep_keys):
         pkg = installed[key]
-        pinned = f"{pkg.pkg_name}=={pkg.version}"
+        bucket = dependencies if pkg.group == GROUP_PROJECT_DEPENDENCY else optional[pkg.group]
+        bucket.append(f"{pkg.pkg_name}=={pkg.version}")
 
-        if pkg.group == GROUP_PROJECT_DEPENDENCY:
-            base_doc["project"]["dependencies"].append(pinned)
-        else:
-            base_doc["project"]["optional-dependencies"].setdefault(pkg.group, []).append(pinned)
-
-    # Create tomlkit inline table for better readability
-    # e.g. torch = { index = "pytorch-cuda" }
-    sources_table = tomlkit.inline_table()
-    sources_table.update(inferred_sources)
-    base_doc["tool"]["uv"]["sources"] = sources_table
+    base_doc["project"]["dependencies"] = dependencies
+    base_doc["project"]["optional-dependencies"] = dict(optional)
 
+    base_doc["tool"]["uv"]["sources"] = inferred_sources
     base_doc["tool"]["uv"]["index"] = merged_indices
 
 
@@ -303,19 +442,32 @@ def render_snapshot(
 def create_snapshot(
     base_toml_path: str,
     requirements_path: str,
-) -> tomlkit.TOMLDocument:
-    base_doc = tomlkit.parse(Path(base_toml_path).read_text(encoding="utf-8"))
-
-    installed = collect_installed_packages()
-    requirements = parse_requirements_file(requirements_path)
-    root_deps = get_uv_root_dependencies()
-
-    assign_package_groups(installed, base_doc, requirements, root_deps)
-
+    installed_raw: Optional[Dict[str, RawPackage]] = None,
+    tree_proc: Optional[subprocess.Popen] = None,
+) -> Dict[str, Any]:
+    # `uv pip tree` runs as a separate process; start it (unless the caller already
+    # did) before the in-process work and only collect its output afterwards
+    if tree_proc is None:
+        tree_proc = start_uv_pip_tree()
+
+    # The `with` makes sure uv is reaped even if the work below raises
+    with tree_proc:
+        with open(base_toml_path, "rb") as f:
+            base_doc = tomllib.load(f)
+        if installed_raw is None:
+            installed_raw = collect_installed_raw()
+        requirements = parse_requirements_file(requirements_path)
+
+        root_deps = read_uv_root_dependencies(tree_proc)
+
+    groups = assign_package_groups(installed_raw, base_doc, requirements, root_deps)
+
+    source_keys = set(map(pkg_key, base_doc["tool"]["uv"]["sources"].keys()))
     keep_keys = {
-        k for k, p in installed.items()
-        if p.group or k in map(pkg_key, base_doc["tool"]["uv"]["sources"].keys())
+        k for k in installed_raw
+        if k in groups or k in source_keys
     }
+    installed = materialize_packages(installed_raw, groups, keep_keys)
 
     assign_uv_index_info(installed, base_doc)
     inferred_sources, merged_indices = build_uv_sections(installed, base_doc, keep_keys)
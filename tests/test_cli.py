@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from env_snapshot import cli, core
+from env_snapshot.core import RawPackage
+
+
+def make_doc(*urls: str) -> dict:
+    return {"tool": {"uv": {"index": [
+        {"name": f"index-{i}", "url": url} for i, url in enumerate(urls)
+    ]}}}
+
+
+class TestTorchIndexUrl(unittest.TestCase):
+
+    def test_no_placeholder_skips_lookup(self):
+        doc = make_doc("https://example.org/simple")
+        with patch.object(core, "installed_version") as lookup:
+            cli.update_torch_index_url(doc)
+        lookup.assert_not_called()
+        self.assertEqual(doc, make_doc("https://example.org/simple"))
+
+    def test_placeholder_follows_installed_torch(self):
+        placeholder = "https://download.pytorch.org/whl/cuXXX"
+        cases = {
+            "2.0.1+cu118": "https://download.pytorch.org/whl/cu118",
+            "2.0.1+cpu": "https://download.pytorch.org/whl/cpu",
+            # No local version label, or torch not installed: leave the placeholder
+            "2.0.1": placeholder,
+            None: placeholder,
+        }
+        for version, expected in cases.items():
+            doc = make_doc(placeholder, "https://example.org/simple")
+            with patch.object(core, "installed_version", return_value=version) as lookup:
+                cli.update_torch_index_url(doc)
+            lookup.assert_called_once_with("torch")
+            self.assertEqual(doc, make_doc(expected, "https://example.org/simple"), version)
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        root = Path(self.tmp.name)
+        self.base = root / "base.toml"
+        self.base.write_text("[project]\nname = 'x'\n", encoding="utf-8")
+        self.reqs = root / "requirements.txt"
+        self.reqs.write_text("numpy\n", encoding="utf-8")
+        self.output = root / "out.toml"
+        self.output.write_text("snapshot\n", encoding="utf-8")
+        self.installed = {"numpy": RawPackage("numpy", "1.24.0", None, False, False)}
+
+        # XDG_CACHE_HOME is used on POSIX, LOCALAPPDATA on Windows
+        env = patch.dict(os.environ, {"XDG_CACHE_HOME": str(root / "cache"), "LOCALAPPDATA": str(root / "cache")})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_hit_and_miss(self):
+        path = cli.snapshot_cache_path(self.base, self.reqs, self.installed)
+        self.assertEqual(path.parent, Path(self.tmp.name) / "cache" / "env_snapshot")
+        self.assertFalse(path.is_file())
+
+        cli.store_snapshot_in_cache(str(self.output), path)
+        self.assertEqual(path.read_text(encoding="utf-8"), "snapshot\n")
+        self.assertEqual(list(path.parent.glob("*.tmp")), [])
+
+        # Same inputs: same entry
+        self.assertEqual(cli.snapshot_cache_path(self.base, self.reqs, dict(self.installed)), path)
+
+        # Any changed input: different entry
+        upgraded = {"numpy": RawPackage("numpy", "1.26.0", None, False, False)}
+        self.assertNotEqual(cli.snapshot_cache_path(self.base, self.reqs, upgraded), path)
+
+        self.reqs.write_text("numpy\nscipy\n", encoding="utf-8")
+        self.assertNotEqual(cli.snapshot_cache_path(self.base, self.reqs, self.installed), path)
+
+    def test_tool_version_invalidates(self):
+        with patch.object(cli, "tool_version", return_value="1.0.0"):
+            old = cli.snapshot_cache_path(self.base, self.reqs, self.installed)
+        with patch.object(cli, "tool_version", return_value="1.1.0"):
+            new = cli.snapshot_cache_path(self.base, self.reqs, self.installed)
+        self.assertNotEqual(old, new)
+
+    def test_failed_store_leaves_no_temp_file(self):
+        path = cli.snapshot_cache_path(self.base, self.reqs, self.installed)
+        with patch.object(cli.os, "replace", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                cli.store_snapshot_in_cache(str(self.output), path)
+        self.assertEqual(list(path.parent.iterdir()), [])
+
+    def test_prune_keeps_most_recent(self):
+        cache = cli.cache_dir()
+        cache.mkdir(parents=True)
+        for i in range(5):
+            entry = cache / f"{i}.toml"
+            entry.write_text("x", encoding="utf-8")
+            os.utime(entry, (i, i))
+        old_tmp = cache / "old.tmp"
+        old_tmp.write_text("x", encoding="utf-8")
+        os.utime(old_tmp, (0, 0))
+        fresh_tmp = cache / "fresh.tmp"
+        fresh_tmp.write_text("x", encoding="utf-8")
+
+        cli.prune_cache(cache, keep=2)
+        self.assertEqual(
+            sorted(p.name for p in cache.iterdir()),
+            ["3.toml", "4.toml", "fresh.tmp"],
+        )
+
+
+class TestMainWithoutUv(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        root = Path(self.tmp.name)
+        self.base = root / "base.toml"
+        self.base.write_text("[project]\nname = 'x'\n", encoding="utf-8")
+        self.reqs = root / "requirements.txt"
+        self.reqs.write_text("numpy\n", encoding="utf-8")
+        self.output = root / "out.toml"
+        self.installed = {"numpy": RawPackage("numpy", "1.24.0", None, False, False)}
+
+        for patcher in (
+            patch.dict(os.environ, {"XDG_CACHE_HOME": str(root / "cache"), "LOCALAPPDATA": str(root / "cache")}),
+            patch.object(core, "collect_installed_raw", return_value=self.installed),
+            patch.object(core, "start_uv_pip_tree", side_effect=FileNotFoundError(2, "No such file", "uv")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def invoke(self):
+        args = ["--base-toml", str(self.base), "--requirements", str(self.reqs), "-o", str(self.output)]
+        return CliRunner().invoke(cli.main, args)
+
+    def test_cache_hit_does_not_need_uv(self):
+        cached = Path(self.tmp.name) / "cached.toml"
+        cached.write_text("cached snapshot\n", encoding="utf-8")
+        cli.store_snapshot_in_cache(str(cached), cli.snapshot_cache_path(self.base, self.reqs, self.installed))
+
+        result = self.invoke()
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.output.read_text(encoding="utf-8"), "cached snapshot\n")
+
+    def test_cache_miss_reports_missing_uv(self):
+        result = self.invoke()
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("uv", result.output)
+        self.assertFalse(self.output.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,78 +1,283 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
-from unittest.mock import MagicMock, patch
-from env_snapshot.core import classify_dependencies, resolve_torch_url
-from env_snapshot.models import Snapshot
-
-class TestCore(unittest.TestCase):
-    
-    def test_resolve_torch_url(self):
-        # Case 1: CUDA 118
-        installed = [{"name": "torch", "version": "2.0.1+cu118"}]
-        url = resolve_torch_url(installed)
-        self.assertEqual(url, "https://download.pytorch.org/whl/cu118")
-        
-        # Case 2: CPU
-        installed = [{"name": "torch", "version": "2.0.1+cpu"}]
-        url = resolve_torch_url(installed)
-        self.assertEqual(url, "https://download.pytorch.org/whl/cpu")
-        
-        # Case 3: No local ID
-        installed = [{"name": "torch", "version": "2.0.1"}]
-        url = resolve_torch_url(installed)
-        self.assertIsNone(url)
-        
-        # Case 4: Not installed
-        url = resolve_torch_url([])
-        self.assertIsNone(url)
-
-    def test_classify_dependencies_with_groups(self):
-        installed = [
-            {"name": "torch", "version": "2.0.1+cu118"},
-            {"name": "numpy", "version": "1.24.0"},
-            {"name": "requests", "version": "2.31.0"},
-            {"name": "my-local-pkg", "version": "0.1.0", "editable": True},
+from pathlib import Path
+from unittest.mock import patch
+
+from packaging.requirements import InvalidRequirement, Requirement
+
+from env_snapshot import core
+from env_snapshot.core import (
+    GROUP_PROJECT_DEPENDENCY,
+    GROUP_USER_COMPILED,
+    GROUP_USER_DOWNLOAD,
+    PRIORITY_BASE_TOML,
+    PRIORITY_ENV_INFERENCE,
+    PRIORITY_REQUIREMENTS,
+    PRIORITY_ROOT_DEPENDENCY,
+    RawPackage,
+    assign_package_groups,
+    collect_installed_raw,
+    parse_requirements_file,
+    requirement_name,
+    target_site_paths,
+)
+
+
+def make_dist(site: Path, name: str, version: str, direct_url: dict = None) -> None:
+    dist_info = site / f"{name.replace('-', '_')}-{version}.dist-info"
+    dist_info.mkdir(parents=True)
+    (dist_info / "METADATA").write_text(
+        f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n", encoding="utf-8"
+    )
+    if direct_url is not None:
+        (dist_info / "direct_url.json").write_text(json.dumps(direct_url), encoding="utf-8")
+
+
+def fake_tree_proc(output: str, returncode: int = 0) -> subprocess.Popen:
+    # Stand-in for `uv pip tree`: a real process writing `output` to a stdout pipe
+    script = f"import sys; sys.stdout.write({output!r}); sys.exit({returncode})"
+    return subprocess.Popen(
+        [sys.executable, "-c", script], stdout=subprocess.PIPE, encoding="utf-8"
+    )
+
+
+class TestEnvironmentCollection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.venv = Path(self.tmp.name) / "venv"
+        self.site = self.venv / "lib" / "python3.11" / "site-packages"
+        self.site.mkdir(parents=True)
+        (self.venv / "pyvenv.cfg").write_text("home = /usr/bin\n", encoding="utf-8")
+
+        target_site_paths.cache_clear()
+        self.addCleanup(target_site_paths.cache_clear)
+
+    def test_target_site_paths_uses_active_virtualenv(self):
+        with patch.dict(os.environ, {"VIRTUAL_ENV": str(self.venv)}):
+            self.assertEqual(target_site_paths(), (str(self.site),))
+
+    def test_target_site_paths_fails_without_any_environment(self):
+        env = {k: v for k, v in os.environ.items() if k not in ("VIRTUAL_ENV", "CONDA_PREFIX")}
+        with patch.dict(os.environ, env, clear=True), \
+                patch.object(core.Path, "cwd", return_value=self.venv), \
+                patch.object(core.shutil, "which", return_value=None):
+            with self.assertRaises(RuntimeError):
+                target_site_paths()
+
+    def test_collect_installed_raw(self):
+        make_dist(self.site, "Plain_Pkg", "1.0")
+        make_dist(self.site, "local-pkg", "0.1.0",
+                  {"url": "file:///src/local-pkg", "dir_info": {"editable": True}})
+        make_dist(self.site, "vcs-pkg", "2.0",
+                  {"url": "https://github.com/a/b.git", "vcs_info": {"vcs": "git", "commit_id": "abc"}})
+
+        with patch.dict(os.environ, {"VIRTUAL_ENV": str(self.venv)}):
+            installed = collect_installed_raw()
+
+        self.assertEqual(installed, {
+            "plain-pkg": RawPackage("Plain_Pkg", "1.0", None, False, False),
+            "local-pkg": RawPackage("local-pkg", "0.1.0", "file:///src/local-pkg", True, False),
+            "vcs-pkg": RawPackage("vcs-pkg", "2.0", "https://github.com/a/b.git", False, True),
+        })
+
+
+class TestUvPipTree(unittest.TestCase):
+
+    def test_root_regex(self):
+        lines = {
+            "torch v2.1.0+cu118": "torch",
+            "├── numpy v1.26.4": "numpy",
+            "└── foo-bar v0.1.0 (*)": "foo-bar",
+            "(*) Package tree already displayed": None,
+            "my vlib v1": None,
+            "": None,
+        }
+        for line, expected in lines.items():
+            m = core._ROOT_RE.match(line)
+            self.assertEqual(m.group(1) if m else None, expected, line)
+
+    def test_read_uv_root_dependencies(self):
+        proc = fake_tree_proc("torch v2.1.0\nnumpy v1.26.4\n")
+        self.assertEqual(core.read_uv_root_dependencies(proc), ["torch", "numpy"])
+        self.assertIsNotNone(proc.returncode)
+
+    def test_read_uv_root_dependencies_failure(self):
+        proc = fake_tree_proc("torch v2.1.0\n", returncode=2)
+        with self.assertRaises(subprocess.CalledProcessError):
+            core.read_uv_root_dependencies(proc)
+
+
+class TestGroupAssignment(unittest.TestCase):
+
+    def test_assign_package_groups(self):
+        installed = {
+            "torch": RawPackage("torch", "2.0.1+cu118", None, False, False),
+            "numpy": RawPackage("numpy", "1.24.0", None, False, False),
+            "requests": RawPackage("requests", "2.31.0", None, False, False),
+            "my-local-pkg": RawPackage("my-local-pkg", "0.1.0", "file:///src/my-local-pkg", True, False),
+            "six": RawPackage("six", "1.16.0", None, False, False),
+        }
+        base_doc = {
+            "project": {
+                "dependencies": ["flask>=3"],
+                "optional-dependencies": {"gpu": ["torch>=2.0"]},
+            },
+        }
+        roots = ["torch", "numpy", "requests", "my-local-pkg"]
+
+        groups = assign_package_groups(installed, base_doc, ["numpy"], roots)
+
+        # Base TOML overrides root dependency
+        self.assertEqual(groups["torch"], ("gpu", PRIORITY_BASE_TOML))
+        # requirements.txt overrides root dependency
+        self.assertEqual(groups["numpy"], (GROUP_PROJECT_DEPENDENCY, PRIORITY_REQUIREMENTS))
+        # Root, not in base, not in reqs
+        self.assertEqual(groups["requests"], (GROUP_USER_DOWNLOAD, PRIORITY_ROOT_DEPENDENCY))
+        # Editable install is inferred from the environment and overrides everything
+        self.assertEqual(groups["my-local-pkg"], (GROUP_USER_COMPILED, PRIORITY_ENV_INFERENCE))
+        # Transitive dependency, and base deps that are not installed, get no group
+        self.assertNotIn("six", groups)
+        self.assertNotIn("flask", groups)
+
+
+class TestRequirementsFile(unittest.TestCase):
+
+    def write(self, tmp: str, content: bytes) -> str:
+        path = Path(tmp) / "requirements.txt"
+        path.write_bytes(content)
+        return str(path)
+
+    def test_parse_requirements_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write(
+                tmp,
+                b"# comment\r\n"
+                b"\n"
+                b"Torch>=2.0\r\n"
+                b"  numpy ; python_version >= '3.10'\n"
+                b"  # indented comment\n"
+                b"foo_bar[extra]==1.0\n"
+                b"pkg @ https://example.org/pkg.whl\n",
+            )
+            self.assertEqual(parse_requirements_file(path), ["torch", "numpy", "foo-bar", "pkg"])
+
+            self.assertEqual(parse_requirements_file(str(Path(tmp) / "missing.txt")), [])
+
+    def test_parse_requirements_file_rejects_url_lines(self):
+        for line in (b"git+https://github.com/a/b.git\n", b"https://x.org/foo.whl\n"):
+            with tempfile.TemporaryDirectory() as tmp:
+                with self.assertRaises(InvalidRequirement, msg=line):
+                    parse_requirements_file(self.write(tmp, line))
+
+
+class TestRequirementName(unittest.TestCase):
+
+    def test_requirement_name_matches_packaging(self):
+        reqs = [
+            "torch>=2.9.1",
+            "numpy",
+            " foo ",
+            "foo == 1.0.*, !=1.0.3",
+            "foo~=1.4",
+            "foo<2,>=1",
+            "foo>=1.0a1",
+            "foo===1.0",
+            "foo[x]>=1",
+            "foo; python_version < '3.11'",
+            "foo @ https://example.org/foo.whl",
         ]
-        
-        root_names = {"torch", "numpy", "requests", "my-local-pkg"}
-        req_names = {"numpy"} # numpy in reqs -> dependencies
-        
-        # Base has torch in 'gpu' group
-        base_dep_map = {"torch": "gpu"}
-        base_toml = {
-            "project": {"name": "test-proj", "version": "0.1"},
-            "tool": {"uv": {"index": [{"name": "pytorch-cuda", "url": "placeholder"}]}}
+        for req in reqs:
+            self.assertEqual(requirement_name(req), Requirement(req).name, req)
+
+        bad = [
+            "foo=1.0",
+            "foo>=1.*",
+            "foo>=1.0 bar",
+            "foo~=1",
+            "https://x.org/foo.whl",
+            # Unicode digit and no-break space
+            "foo>=١",
+            "foo\xa0>=1",
+        ]
+        for req in bad:
+            with self.assertRaises(InvalidRequirement, msg=req):
+                Requirement(req)
+            with self.assertRaises(InvalidRequirement, msg=req):
+                requirement_name(req)
+
+
+BASE_TOML = """\
+[project]
+name = "snapshot-test"
+version = "0.1.0"
+dependencies = ["flask>=3"]
+
+[project.optional-dependencies]
+gpu = ["torch>=2.0"]
+
+[tool.uv.sources]
+torch = { index = "pytorch-cuda" }
+xformers = { index = "pytorch-cuda" }
+
+[[tool.uv.index]]
+name = "pytorch-cuda"
+url = "https://download.pytorch.org/whl/cuXXX"
+explicit = true
+"""
+
+
+class TestCreateSnapshot(unittest.TestCase):
+
+    def test_create_snapshot(self):
+        wheel_url = "https://files.example.org/wheels/wheel_pkg-1.0-py3-none-any.whl"
+        installed_raw = {
+            "torch": RawPackage("torch", "2.0.1+cu118", None, False, False),
+            "flask": RawPackage("Flask", "3.0.0", None, False, False),
+            "numpy": RawPackage("numpy", "1.24.0", None, False, False),
+            "requests": RawPackage("requests", "2.31.0", None, False, False),
+            "local-pkg": RawPackage("local-pkg", "0.1.0", "file:///src/local-pkg", True, False),
+            "wheel-pkg": RawPackage("wheel-pkg", "1.0", wheel_url, False, False),
+            "six": RawPackage("six", "1.16.0", None, False, False),
         }
-        
-        snapshot = classify_dependencies(installed, root_names, req_names, base_dep_map, base_toml)
-        
-        # Check Torch is in Optional 'gpu'
-        self.assertNotIn("torch==2.0.1+cu118", snapshot.dependencies)
-        self.assertIn("gpu", snapshot.optional_dependencies)
-        self.assertIn("torch==2.0.1+cu118", snapshot.optional_dependencies["gpu"])
-        
-        # Check Numpy: Is in req_names -> dependencies list
-        self.assertIn("numpy", snapshot.dependencies)
-        # Should NOT be in user-downloaded even if it is a root
-        self.assertNotIn("numpy", snapshot.user_downloaded)
-        
-        # Requests (root, not in base, not in reqs) -> user-downloaded
-        self.assertIn("requests", snapshot.user_downloaded)
-        
-        # Check user-compiled (editable)
-        self.assertEqual(len(snapshot.user_compiled), 1)
-        self.assertIn("my-local-pkg (editable/local)", snapshot.user_compiled)
-
-    def test_classify_dependencies_main_group(self):
-        installed = [{"name": "flask", "version": "3.0.0"}]
-        root_names = {"flask"}
-        req_names = set()
-        base_dep_map = {"flask": "main"}
-        base_toml = {}
-        
-        snapshot = classify_dependencies(installed, root_names, req_names, base_dep_map, base_toml)
-        
-        self.assertIn("flask==3.0.0", snapshot.dependencies)
-        self.assertEqual(len(snapshot.user_downloaded), 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp) / "base.toml"
+            base.write_text(BASE_TOML, encoding="utf-8")
+            reqs = Path(tmp) / "requirements.txt"
+            reqs.write_text("numpy\n", encoding="utf-8")
+            tree_proc = fake_tree_proc("torch v2.0.1+cu118\nrequests v2.31.0\n")
+
+            doc = core.create_snapshot(
+                str(base), str(reqs), installed_raw=installed_raw, tree_proc=tree_proc
+            )
+
+        self.assertIsNotNone(tree_proc.returncode)
+
+        self.assertEqual(doc["project"]["dependencies"], ["Flask==3.0.0", "numpy==1.24.0"])
+        # Groups appear in the order of their first package; six (transitive) is dropped
+        self.assertEqual(list(doc["project"]["optional-dependencies"].items()), [
+            (GROUP_USER_COMPILED, ["local-pkg==0.1.0"]),
+            (GROUP_USER_DOWNLOAD, ["requests==2.31.0", "wheel-pkg==1.0"]),
+            ("gpu", ["torch==2.0.1+cu118"]),
+        ])
+
+        # Sources: declared ones that are installed, plus ones inferred from direct URLs
+        self.assertEqual(doc["tool"]["uv"]["sources"], {
+            "torch": {"index": "pytorch-cuda"},
+            "wheel-pkg": {"index": "files.example.org"},
+        })
+        # The base index list is extended in place with the inferred index only
+        self.assertEqual(doc["tool"]["uv"]["index"], [
+            {"name": "pytorch-cuda", "url": "https://download.pytorch.org/whl/cuXXX", "explicit": True},
+            {"name": "files.example.org", "url": wheel_url, "explicit": True},
+        ])
+
 
 if __name__ == "__main__":
     unittest.main()